@@ -7,9 +7,9 @@ Goals
   • Open the serial interface ONCE
   • Send compact JSON GET requests over TEXT_MESSAGE_APP
   • Broadcast to ^all on a specific channel index (env: DEFAULT_CHANNEL_INDEX)
-  • Robust RX: parse decoded.text or decoded.payload (bytes or list[int])
+  • Robust RX: parse decoded.payload (bytes or list[int]) or decoded.text
   • Reassemble RESP fragments (frag/of or of_frag) and output to stdout or file
-  • Wire both iface.onReceive and pubsub (meshtastic.receive), like server2
+  • Single RX path via pubsub (meshtastic.receive)
 
 Usage examples
   MESHTASTIC_PORT=/dev/ttyACM1 python client2.py --path /index.html
@@ -23,10 +23,13 @@ Env flags
 from __future__ import annotations
 
 import argparse
+import collections
 import json
 import os
 import sys
+import threading
 import time
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, Tuple
 
@@ -34,9 +37,16 @@ from pubsub import pub
 
 from radio import RadioInterface  # same resilient resolver server2 uses
 
-TRUTHY = {"1", "true", "yes", "on", "y"}
+try:
+    import orjson  # optional: much faster JSON on Pi-class hosts
+except Exception:
+    orjson = None
 
+TRUTHY = frozenset({"1", "true", "yes", "on", "y"})
+
+@lru_cache(maxsize=32)
 def _is_on(name: str) -> bool:
+    """Truthy env flag; cached since flags do not change at runtime."""
     return (os.getenv(name) or "").strip().lower() in TRUTHY
 
 def _downloads_dir() -> Path:
@@ -56,159 +66,351 @@ def _default_channel_index() -> int:
         return 1
 
 
-def _payload_text(packet: dict) -> str | None:
-    """Extract UTF-8 text from packet.decoded (text or payload bytes/list[int])."""
-    if not isinstance(packet, dict):
-        return None
-    dec = packet.get("decoded") if isinstance(packet, dict) else None
-    if not isinstance(dec, dict):
-        return None
-    # Preferred: decoded.text
-    txt = dec.get("text")
-    if isinstance(txt, str):
-        return txt
-    # Fallback: decoded.payload -> utf-8
-    raw = dec.get("payload")
-    if isinstance(raw, (bytes, bytearray)):
-        try:
-            return raw.decode("utf-8", errors="replace")
-        except Exception:
-            return None
-    if isinstance(raw, list) and all(isinstance(b, int) for b in raw):
-        try:
-            return bytes(raw).decode("utf-8", errors="replace")
-        except Exception:
+# Resolved once at import; these are read on every TX/RX
+_DEFAULT_CHANNEL_INDEX = _default_channel_index()
+_LISTENER_DEBUG = _is_on("LISTENER_DEBUG")
+
+
+def _payload_bytes(packet: dict) -> bytes | None:
+    """Extract the UTF-8 payload from packet.decoded (payload bytes/list[int] or text).
+    Returned as bytes: the JSON parser takes bytes directly, so no decode is needed.
+    """
+    match packet:
+        # Position/telemetry/nodeinfo traffic can never carry a RESP; skip it early
+        case {"decoded": {"portnum": portnum}} if portnum not in (None, "TEXT_MESSAGE_APP", 1):
             return None
+        # Preferred: decoded.payload, the raw bytes meshtastic received
+        case {"decoded": {"payload": bytes() as raw}}:
+            return raw
+        case {"decoded": {"payload": bytearray() as raw}}:
+            return bytes(raw)
+        case {"decoded": {"payload": list() as raw}}:
+            # bytes() validates the ints in C; no per-element isinstance scan
+            try:
+                return bytes(raw)
+            except (TypeError, ValueError):
+                return None
+        # Fallback: decoded.text
+        case {"decoded": {"text": str() as txt}}:
+            return txt.encode("utf-8")
     return None
 
 
-def _send_text(radio, iface, payload: str):
-    """Send a TEXT frame. Prefer radio.send(); fallback to iface.sendText with broadcast."""
-    ch = _default_channel_index()
+def _dumps(obj) -> str:
+    """Compact JSON text for the wire (orjson when available)."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, separators=(",", ":"))
+
+
+def _loads(txt):
+    return orjson.loads(txt) if orjson is not None else json.loads(txt)
+
+
+@lru_cache(maxsize=512)
+def _parse_json_text(txt: bytes) -> dict | None:
+    """Parse a JSON object from payload bytes; memoized so repeated fragments parse once.
+    Callers must treat the returned dict as read-only (it is shared).
+    """
+    if not txt.startswith(b"{"):
+        return None
+    try:
+        js = _loads(txt)
+    except Exception:
+        return None
+    return js if isinstance(js, dict) else None
+
+
+# Serialized GET envelopes keyed by (path, frag); retransmits reuse the same text.
+# frag is an int for a single fragment or a tuple for a batched "missing" list.
+_GET_CACHE: Dict[Tuple[str, int | Tuple[int, ...] | None], str] = {}
+
+# Packet ids remembered for duplicate suppression
+SEEN_IDS_MAX = 1024
+
+# Fragment numbers per batched re-request (and per retry tick); keeps the GET
+# well under a LoRa frame
+MAX_MISSING_PER_GET = 24
+
+
+def _get_payload(path: str, frag: int | Tuple[int, ...] | None = None) -> str:
+    """Return the compact JSON GET envelope for path (and optional fragment(s))."""
+    k = (path, frag)
+    text = _GET_CACHE.get(k)
+    if text is None:
+        req = {"type": "GET", "path": path}
+        if isinstance(frag, tuple):
+            req["missing"] = list(frag)
+        elif frag is not None:
+            req["frag"] = frag
+        text = _dumps(req)
+        if len(_GET_CACHE) > 256:
+            _GET_CACHE.clear()
+        _GET_CACHE[k] = text
+    return text
+
+
+def _send_text(send, iface, payload: str, ch: int | None = None):
+    """Send a TEXT frame. Prefer send (a pre-resolved radio.send, or None);
+    fallback to iface.sendText with broadcast."""
+    if ch is None:
+        ch = _DEFAULT_CHANNEL_INDEX
+    # Per-frame TX logs only when debugging; retries can send many frames
+    debug = _LISTENER_DEBUG
     try:
-        if hasattr(radio, "send"):
-            print(f"[TX  ] channel={ch} payload={payload}")
-            radio.send(payload)
+        if send is not None:
+            if debug:
+                print(f"[TX  ] channel={ch} payload={payload}")
+            send(payload)
             return
     except Exception as e:
         print(f"[TX  ] WARN: radio.send failed; falling back to iface.sendText: {e}")
     # Explicit broadcast to ^all on chosen channel
-    print(f"[TX  ] channel={ch} to=^all payload={payload}")
+    if debug:
+        print(f"[TX  ] channel={ch} to=^all payload={payload}")
     iface.sendText(payload, destinationId="^all", channelIndex=int(ch))
 
+
 # ----------------------------- Client logic ----------------------------------
 
 class MiniHttpClient:
-    def __init__(self, path: str, want_frag: int | None, out_path: Path | None, timeout: float):
+    def __init__(self, path: str, want_frag: int | None, out_path: Path | None, timeout: float,
+                 retry: float = 10.0):
         self.path = path
         self.want_frag = want_frag
         self.out_path = out_path
+        # Decide output path once: explicit --out wins; otherwise downloads/<basename>.
+        # Create its directory now so a bad location fails before we wait on RX.
+        self._out_path = out_path or (_downloads_dir() / (Path(path).name or "index.html"))
+        self._out_path.parent.mkdir(parents=True, exist_ok=True)
         self.timeout = max(1.0, float(timeout))
+        self.retry = max(1.0, float(retry))
+        # Quoted path as it appears in a RESP; lets foreign-path traffic skip the JSON
+        # parse. Only used for plain ASCII paths, which encode identically everywhere.
+        safe = path.isascii() and path.isprintable() and '"' not in path and "\\" not in path
+        self._path_needle = f'"{path}"'.encode() if safe else None
         self.radio = RadioInterface()
         self.iface = getattr(self.radio, "iface", self.radio)
-        self.debug = _is_on("LISTENER_DEBUG")
+        # Bind the preferred sender once instead of probing the radio per frame
+        self._radio_send = getattr(self.radio, "send", None)
+        self.debug = _LISTENER_DEBUG
+        # Resolve the TX channel once rather than re-reading the env per frame
+        ch = getattr(self.radio, "default_channel_index", None)
+        self.channel_index = int(ch) if ch is not None else _DEFAULT_CHANNEL_INDEX
+        # The GET never changes; serialize it once for the initial send and resends
+        self._tx_payload = _get_payload(path, int(want_frag) if want_frag is not None else None)
         self.start_time = time.time()
-        # buffers[path] = (total_of, {frag_idx: data})
-        self.buffers: Dict[str, Tuple[int, Dict[int, str]]] = {}
+        # Set by _emit once the response has been written
+        self.done = threading.Event()
+        # buffers[path] = (total_of, assembled, next_expected, pending)
+        #   assembled: bytearray of fragments 1..next_expected-1, appended in order
+        #   pending:   out-of-order fragments waiting for the gap before them
+        self.buffers: Dict[str, Tuple[int, bytearray, int, Dict[int, bytes]]] = {}
+        # Recently handled packet ids (duplicate deliveries are dropped early)
+        self._seen_ids: collections.OrderedDict = collections.OrderedDict()
+        # Quiet-period timer that re-requests missing fragments
+        self._lock = threading.Lock()
+        self._retry_timer: threading.Timer | None = None
 
     # ---- TX ----
     def send_get(self) -> None:
-        req = {"type": "GET", "path": self.path}
-        if self.want_frag is not None:
-            req["frag"] = int(self.want_frag)
-        payload = json.dumps(req, separators=(",", ":"))
-        if self.debug:
-            print(f"[TX  ] GET {payload}")
-        _send_text(self.radio, self.iface, payload)
+        print(f"[TX  ] GET {self.path}" + (f" frag {self.want_frag}" if self.want_frag is not None else ""))
+        _send_text(self._radio_send, self.iface, self._tx_payload, self.channel_index)
+
+    def _schedule_retry(self) -> None:
+        """(Re)start the quiet-period timer; fires `retry` seconds after the last activity."""
+        with self._lock:
+            if self._retry_timer is not None:
+                self._retry_timer.cancel()
+            self._retry_timer = threading.Timer(self.retry, self._request_missing)
+            self._retry_timer.daemon = True
+            self._retry_timer.start()
+
+    def _request_missing(self) -> None:
+        if self.done.is_set():
+            return
+        with self._lock:
+            entry = self.buffers.get(self.path)
+            missing = None
+            if entry is not None and self.want_frag is None:
+                total, _, nxt, pending = entry
+                missing = [i for i in range(nxt, total + 1) if i not in pending]
+        if missing is None:
+            # Nothing usable arrived yet (GET or reply lost): ask again
+            print(f"[RTRY] {self.path} no response yet; resending GET")
+            self.send_get()
+        elif missing:
+            print(f"[RTRY] {self.path} missing {len(missing)}/{total}: {missing}")
+            # Rate limit: one batched GET per tick. The server answers fragments
+            # one airtime slot at a time, so asking for more only queues duplicates;
+            # whatever is still missing goes out on the next tick.
+            batch = tuple(missing[:MAX_MISSING_PER_GET])
+            _send_text(self._radio_send, self.iface, _get_payload(self.path, batch), self.channel_index)
+        else:
+            return
+        # Keep asking until the transfer completes or run() times out
+        self._schedule_retry()
 
     # ---- RX ----
+    def _seen_before(self, packet) -> bool:
+        """Return True if this packet was already handled; records it otherwise."""
+        if type(packet) is dict:
+            pid = packet.get("id")
+        else:
+            pid = hash(str(packet)[:64])
+        if pid is None:
+            return False
+        if pid in self._seen_ids:
+            return True
+        self._seen_ids[pid] = None
+        if len(self._seen_ids) > SEEN_IDS_MAX:
+            self._seen_ids.popitem(last=False)
+        return False
+
     def _handle_packet(self, packet: dict) -> None:
+        if self.done.is_set() or self._seen_before(packet):
+            return
         if self.debug:
             print(f"[RAW ] {packet}")
-        txt = _payload_text(packet)
-        if not isinstance(txt, str):
+        txt_b = _payload_bytes(packet)
+        if txt_b is None:
             return
-        # Try JSON decode (ignore non-JSON text)
-        try:
-            js = json.loads(txt)
-        except Exception:
+        if self._path_needle is not None and self._path_needle not in txt_b:
+            return
+        # Try JSON decode straight from bytes (ignore non-JSON text)
+        js = _parse_json_text(txt_b)
+        if js is None:
             if self.debug:
-                print(f"[TEXT] {txt}")
+                print(f"[TEXT] {txt_b.decode('utf-8', errors='replace')}")
             return
         # Expect RESP envelopes for our requested path
-        if not isinstance(js, dict) or str(js.get("type", "")).upper() != "RESP":
+        if str(js.get("type", "")).upper() != "RESP":
             return
         if js.get("path") != self.path:
             return
         frag = int(js.get("frag", 1))
         total = int(js.get("of") or js.get("of_frag") or 1)
-        data = str(js.get("data", ""))
+        # Keep fragments as UTF-8 bytes so completion is a straight buffer copy
+        data = str(js.get("data", "")).encode("utf-8")
         if self.want_frag is not None and frag != self.want_frag:
             return
-        # store
-        prev_total, frags = self.buffers.get(self.path, (total, {}))
-        frags[frag] = data
-        self.buffers[self.path] = (max(prev_total, total), frags)
+        if frag < 1:
+            return
+        # store: in-order fragments extend the assembled buffer directly (the
+        # common LoRa case); anything ahead of a gap waits in `pending`
+        with self._lock:
+            entry = self.buffers.get(self.path)
+            if entry is None:
+                entry = (total, bytearray(), 1, {})
+            prev_total, assembled, nxt, pending = entry
+            total = max(prev_total, total)
+            if frag > total:
+                return
+            progressed = frag >= nxt and frag not in pending
+            if progressed:
+                if frag == nxt:
+                    assembled += data
+                    nxt += 1
+                    while nxt in pending:
+                        assembled += pending.pop(nxt)
+                        nxt += 1
+                else:
+                    pending[frag] = data
+            self.buffers[self.path] = (total, assembled, nxt, pending)
+            have = nxt - 1 + len(pending)
         if self.debug:
-            have = len(frags)
             print(f"[RX  ] {self.path} {frag}/{total} (have {have}/{total})")
         # flush when complete or when single-frag requested
         if self.want_frag is not None:
             self._flush(single=True)
         else:
             self._flush()
+            # Only new fragments count as progress; duplicates don't postpone a repair
+            if progressed and not self.done.is_set():
+                self._schedule_retry()
 
     def _flush(self, *, single: bool = False) -> None:
-        total, frags = self.buffers.get(self.path, (0, {}))
         if single:
-            if not frags:
+            with self._lock:
+                total, assembled, nxt, pending = self.buffers.get(self.path, (0, bytearray(), 1, {}))
+                # Only the wanted fragment is stored: at the head if it is frag 1, else pending
+                content = bytes(assembled) if nxt > self.want_frag else pending.get(self.want_frag)
+            if content is None:
                 return
-            frag_idx = min(frags)  # the one we got
-            self._emit(frags[frag_idx])
+            self._release()
+            self._emit(content)
             return
-        if total and len(frags) >= total:
-            chunks = [frags[i] for i in range(1, total + 1) if i in frags]
-            if len(chunks) == total:
-                self._emit("".join(chunks))
-
-    def _emit(self, content: str) -> None:
-        # Decide output path: explicit --out wins; otherwise ~/Downloads/<basename>
-        if self.out_path:
-            out_path = self.out_path
-        else:
-            base = Path(self.path).name or "index.html"
-            out_path = _downloads_dir() / base
-        # Ensure parent exists
-        out_path.parent.mkdir(parents=True, exist_ok=True)
-        out_path.write_text(content, encoding="utf-8")
-        print(f"[SAVE] wrote {out_path}")
-        # Successful completion → exit
-        os._exit(0)
+        assembled = self._take_complete()
+        if assembled is not None:
+            self._emit(assembled)
+
+    def _take_complete(self) -> bytearray | None:
+        """Pop our buffer if every fragment is in; the check and the pop share the lock
+        so the retry timer cannot see or rebuild the entry mid hand-off."""
+        with self._lock:
+            entry = self.buffers.get(self.path)
+            if entry is None:
+                return None
+            total, assembled, nxt, _pending = entry
+            if not total or nxt <= total:
+                return None
+            del self.buffers[self.path]
+            # Already contiguous; hand the buffer over without another join/copy
+            return assembled
+
+    def _release(self) -> None:
+        """Drop the fragment buffers for our path once they have been assembled."""
+        with self._lock:
+            entry = self.buffers.pop(self.path, None)
+            if entry is not None:
+                entry[1].clear()
+                entry[3].clear()
+
+    def _emit(self, content: bytes | bytearray) -> None:
+        self._out_path.write_bytes(content)
+        print(f"[SAVE] wrote {self._out_path}")
+        # Successful completion → wake run()
+        self.done.set()
+        with self._lock:
+            if self._retry_timer is not None:
+                self._retry_timer.cancel()
 
     # ---- Wiring ----
-    def run(self) -> None:
+    def run(self) -> int:
+        """Send the GET and block until done; returns a process exit code."""
         dev = getattr(self.iface, 'devPath', None) or getattr(self.iface, 'port', None)
         print(f"[INFO] Using serial port: {dev}")
-        # iface callback
-        def _iface_on_receive(packet, interface):
-            self._handle_packet(packet)
-        self.iface.onReceive = _iface_on_receive
-        print("[INFO] Attached iface.onReceive callback")
-        # PubSub too (server2-style)
+        # PubSub only: meshtastic publishes every packet to meshtastic.receive
+        # (child topics included), so a second iface.onReceive hook just
+        # delivers each packet twice.
         def _on_pub(packet=None, interface=None, **kw):
             self._handle_packet(packet)
         pub.subscribe(_on_pub, "meshtastic.receive")
         print("[INFO] Subscribed to meshtastic.receive")
-        # Send GET
+        # Send GET; the retry timer resends it if nothing comes back
         self.send_get()
-        # Wait until timeout
-        deadline = self.start_time + self.timeout
+        self._schedule_retry()
+        # Block until _emit signals completion or the timeout expires
+        remaining = self.start_time + self.timeout - time.time()
         try:
-            while time.time() < deadline:
-                time.sleep(0.1)
+            if self.done.wait(max(0.0, remaining)):
+                return 0
             print(f"[ERR ] Timeout after {self.timeout:.1f}s waiting for {self.path}")
-            os._exit(2)
+            return 2
         except KeyboardInterrupt:
+            print("[INFO] Interrupted")
+            return 130
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """Stop the retry timer and release the serial port."""
+        with self._lock:
+            if self._retry_timer is not None:
+                self._retry_timer.cancel()
+        try:
+            self.iface.close()
+        except Exception:
             pass
 
 # ----------------------------- CLI ------------------------------------------
@@ -219,9 +421,13 @@ def main():
     ap.add_argument("--frag", type=int, default=None, help="Specific fragment to fetch (1-based)")
     ap.add_argument("--out", type=Path, default=None, help="Write response body to file")
     ap.add_argument("--timeout", type=float, default=30.0, help="Seconds to wait before failing")
+    ap.add_argument("--retry", type=float, default=10.0,
+                    help="Seconds of silence before re-requesting missing fragments")
     args = ap.parse_args()
 
-    MiniHttpClient(path=args.path, want_frag=args.frag, out_path=args.out, timeout=args.timeout).run()
+    code = MiniHttpClient(path=args.path, want_frag=args.frag, out_path=args.out, timeout=args.timeout,
+                          retry=args.retry).run()
+    sys.exit(code)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
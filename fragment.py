@@ -1,14 +1,27 @@
-
-def fragment_html_file(filepath):
+def fragment_html_file(filepath, size=122):
     """
-    Reads an HTML file and returns a list of 122-byte fragments.
+    Reads an HTML file and returns a list of fragments of at most `size`
+    UTF-8 bytes each (122 by default), never splitting a multi-byte character.
     """
-    fragments = []
-    with open(filepath, 'r', encoding='utf-8') as f:
-        content = f.read()
+    with open(filepath, 'rb') as f:
+        data = f.read()
 
-    for i in range(0, len(content), 122):
-        chunk = content[i:i+122]
-        fragments.append(chunk)
+    # Plain ASCII (the common case): every byte boundary is a character boundary
+    if data.isascii():
+        return [data[i:i + size].decode('ascii') for i in range(0, len(data), size)]
+
+    mv = memoryview(data)
+    n = len(mv)
+    fragments = []
+    i = 0
+    while i < n:
+        end = min(i + size, n)
+        # Back off over UTF-8 continuation bytes (0b10xxxxxx) so the cut lands on a boundary
+        while i < end < n and (mv[end] & 0xC0) == 0x80:
+            end -= 1
+        if end == i:
+            end = min(i + size, n)
+        fragments.append(str(mv[i:end], 'utf-8', 'replace'))
+        i = end
 
-    return fragments
\ No newline at end of file
+    return fragments
@@ -8,6 +8,9 @@ Goals
 - Optionally enforce LoRa region & modem preset via API.
 - Optionally set/update a single channel (name+psk) at a given index via API.
 - Idempotent: reads current state first and only writes if different.
+  A fingerprint of the applied settings is kept in ~/.webtastic/provisioned_<nodeNum>;
+  identical repeat runs stop there without reading the device, so changes made by
+  other tools are not noticed; pass --force to re-check and correct them.
 - Verbose, with --dry-run support.
 
 Usage examples
@@ -27,13 +30,19 @@ python3 provision.py --enforce-lora --region US --preset LONG_FAST
 python3 provision.py --set-channel --index 1 --name webtastic \
     --psk 0x8e2a4b7c5d1e3f6a9b0c2d4e6f8a1b3c5d7e9f0a2b4c6d8e0f1a3b5c7d9e1f2a
 
+# Provision several radios at once with the same settings
+python3 provision.py --apply-url --ports /dev/ttyACM0,/dev/ttyACM1
+
 # Dry-run to see what would change
 python3 provision.py --apply-url --enforce-lora --set-channel --index 1 --name webtastic --psk 0x... --dry-run
 """
 
 import argparse
+import hashlib
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from typing import Optional
 
 from radio import (
@@ -47,6 +56,14 @@ try:
 except Exception:
     config_pb2 = None  # We will guard usage
 
+# Enum name -> value maps, built once; lookups are case-insensitive
+if config_pb2 is not None:
+    REGIONS = dict(config_pb2.Config.LoRaConfig.Region.items())
+    PRESETS = dict(config_pb2.Config.LoRaConfig.ModemPreset.items())
+else:
+    REGIONS = {}
+    PRESETS = {}
+
 # -------------------------- Logging helpers --------------------------
 
 def log(msg: str, *, level: str = "INFO", quiet: bool = False) -> None:
@@ -91,6 +108,22 @@ def _ensure_url(node, url: str, *, dry_run=False) -> bool:
     node.setURL(url)
     return True
 
+def _check_lora_names(region: Optional[str], preset: Optional[str]) -> tuple:
+    """Return the canonical (REGION, PRESET) enum names, None where not given.
+    Fails early (SystemExit, like _ensure_lora) on names the firmware does not know.
+    """
+    if not (region or preset):
+        return None, None
+    if config_pb2 is None:
+        raise SystemExit("meshtastic.protobuf.config_pb2 not available; cannot enforce LoRa settings")
+    canon_region = region.strip().upper() if region else None
+    canon_preset = preset.strip().upper() if preset else None
+    if canon_region and canon_region not in REGIONS:
+        raise SystemExit(f"Unknown region '{region}'. Valid: {', '.join(REGIONS)}")
+    if canon_preset and canon_preset not in PRESETS:
+        raise SystemExit(f"Unknown modem preset '{preset}'. Valid: {', '.join(PRESETS)}")
+    return canon_region, canon_preset
+
 def _ensure_lora(node, region: Optional[str], preset: Optional[str], *, dry_run=False) -> bool:
     if not node or not getattr(node, "localConfig", None):
         return False
@@ -99,23 +132,21 @@ def _ensure_lora(node, region: Optional[str], preset: Optional[str], *, dry_run=
     lora = node.localConfig.lora
     changed = False
     if region:
-        try:
-            val = config_pb2.Config.LoRaConfig.Region.Value(region)
-            if lora.region != val:
-                if not dry_run:
-                    lora.region = val
-                changed = True
-        except Exception:
-            raise SystemExit(f"Unknown region '{region}'. Valid values depend on firmware.")
+        val = REGIONS.get(region.strip().upper())
+        if val is None:
+            raise SystemExit(f"Unknown region '{region}'. Valid: {', '.join(REGIONS)}")
+        if lora.region != val:
+            if not dry_run:
+                lora.region = val
+            changed = True
     if preset:
-        try:
-            val = config_pb2.Config.LoRaConfig.ModemPreset.Value(preset)
-            if lora.modem_preset != val:
-                if not dry_run:
-                    lora.modem_preset = val
-                changed = True
-        except Exception:
-            raise SystemExit(f"Unknown modem preset '{preset}'.")
+        val = PRESETS.get(preset.strip().upper())
+        if val is None:
+            raise SystemExit(f"Unknown modem preset '{preset}'. Valid: {', '.join(PRESETS)}")
+        if lora.modem_preset != val:
+            if not dry_run:
+                lora.modem_preset = val
+            changed = True
     if changed and not dry_run:
         node.writeConfig("lora")
     return changed
@@ -143,6 +174,143 @@ def _ensure_channel(node, *, index: int, name: str, psk: str, dry_run=False) ->
             node.setChannel(index=index, name=name, psk=psk)
     return changed
 
+# -------------------------- Fingerprint cache --------------------------
+
+STATE_DIR = Path.home() / ".webtastic"
+
+def _fingerprint(url, region, preset, index, name, psk) -> str:
+    """Short hash of everything we would apply; equal hashes mean nothing to do."""
+    parts = "|".join("" if v is None else str(v) for v in (url, region, preset, index, name, psk))
+    return hashlib.blake2b(parts.encode("utf-8"), digest_size=8).hexdigest()
+
+def _node_num(iface) -> Optional[int]:
+    info = getattr(iface, "myInfo", None)
+    return getattr(info, "my_node_num", None)
+
+def _fingerprint_path(node_num) -> Path:
+    return STATE_DIR / f"provisioned_{node_num}"
+
+def _read_fingerprint(node_num) -> Optional[str]:
+    try:
+        return _fingerprint_path(node_num).read_text().strip() or None
+    except Exception:
+        return None
+
+def _write_fingerprint(node_num, fp: str) -> None:
+    try:
+        STATE_DIR.mkdir(parents=True, exist_ok=True)
+        _fingerprint_path(node_num).write_text(fp + "\n")
+    except Exception as e:
+        log(f"Could not record provisioning state: {e}", level="WARN")
+
+# -------------------------- Provisioning --------------------------
+
+def provision_one(port: Optional[str], args, set_url: Optional[str]) -> int:
+    """Provision the radio on `port` (None: MESHTASTIC_PORT / auto-detect). Returns 0 on success, 2 on error.
+    An explicit `port` must exist; it is never swapped for an auto-detected device.
+    """
+    tag = f"{port}: " if port else ""
+
+    def say(msg: str, level: str = "INFO") -> None:
+        log(tag + msg, level=level, quiet=args.quiet)
+
+    # An explicit --ports entry must be that exact device: get_radio_interface would
+    # otherwise fall back to the newest auto-detected tty, which may be a different
+    # radio (or one another worker already has open)
+    if port and not os.path.exists(port):
+        print(f"[ERROR] {tag}Serial port does not exist; not falling back to auto-detect")
+        return 2
+
+    # Open serial interface (env MESHTASTIC_PORT recommended to avoid TCP fallback)
+    try:
+        iface = get_radio_interface(port)
+    except Exception as e:
+        print(f"[ERROR] {tag}Could not open serial interface: {e}")
+        return 2
+    try:
+        node = _api_get_node(iface)
+        if not node:
+            print(f"[ERROR] {tag}Serial interface did not initialize (no localNode). Set MESHTASTIC_PORT to your /dev/tty.* path.")
+            return 2
+
+        region = args.region or os.getenv("MESHTASTIC_LORA_REGION")
+        preset = args.preset or os.getenv("MESHTASTIC_LORA_MODEM_PRESET")
+        if args.enforce_lora:
+            # Canonical names, so 'us' and 'US' fingerprint the same; bad names fail
+            # here, before any write or settings transaction
+            region, preset = _check_lora_names(region, preset)
+
+        # Repeat runs with identical inputs skip the serial reads/writes entirely
+        node_num = _node_num(iface)
+        fp = _fingerprint(
+            set_url if args.apply_url else None,
+            region if args.enforce_lora else None,
+            preset if args.enforce_lora else None,
+            args.index if args.set_channel else None,
+            args.name if args.set_channel else None,
+            args.psk if args.set_channel else None,
+        )
+        if node_num is not None and not args.dry_run and not args.force:
+            if _read_fingerprint(node_num) == fp:
+                say(f"Node {node_num} already provisioned with these settings (use --force to re-check).")
+                return 0
+
+        changed_any = False
+
+        # URL
+        if args.apply_url:
+            did = _ensure_url(node, set_url, dry_run=args.dry_run)
+            say(("Would apply URL" if args.dry_run else "Applied URL") if did else "URL already matches")
+            changed_any = changed_any or did
+
+        # LoRa + channel each trigger an admin round trip (and possibly a reboot);
+        # group them in one settings transaction when the firmware API has it
+        txn = (not args.dry_run and args.enforce_lora and args.set_channel
+               and hasattr(node, "beginSettingsTransaction") and hasattr(node, "commitSettingsTransaction"))
+        if txn:
+            node.beginSettingsTransaction()
+        try:
+            # LoRa
+            if args.enforce_lora:
+                did = _ensure_lora(node, region, preset, dry_run=args.dry_run)
+                if region or preset:
+                    say(("Would update LoRa" if args.dry_run else "Updated LoRa") if did else "LoRa already matches")
+                else:
+                    say("No region/preset provided; skipping LoRa changes", level="WARN")
+                changed_any = changed_any or did
+
+            # Channel
+            if args.set_channel:
+                did = _ensure_channel(node, index=args.index, name=args.name, psk=args.psk, dry_run=args.dry_run)
+                say(("Would update channel" if args.dry_run else "Updated channel") if did else "Channel already matches")
+                changed_any = changed_any or did
+        finally:
+            # Never leave the node inside an open transaction, even if a write failed
+            if txn:
+                node.commitSettingsTransaction()
+
+        if args.dry_run:
+            say("Dry-run complete.")
+        else:
+            say("Provisioning complete." if changed_any else "No changes were necessary.")
+            if node_num is not None:
+                _write_fingerprint(node_num, fp)
+        return 0
+
+    except SystemExit as e:
+        # _ensure_lora reports bad enum names via SystemExit; keep other workers running
+        print(f"[ERROR] {tag}{e}")
+        return 2
+    except Exception as e:
+        # Serial/API failures on one radio must not abort the other ports
+        print(f"[ERROR] {tag}Provisioning failed: {e}")
+        return 2
+    finally:
+        try:
+            iface.close()
+        except Exception:
+            pass
+
 # -------------------------- Main --------------------------
 
 def main():
@@ -161,7 +329,10 @@ def main():
     parser.add_argument("--psk", type=str, help="Channel PSK (0xHEX or base64)")
 
     parser.add_argument("--dry-run", action="store_true", help="Print what would change without writing")
+    parser.add_argument("--force", action="store_true", help="Ignore the cached provisioning fingerprint and re-check the device. "
+                        "Without it, a cache hit skips all device reads, so settings changed by hand are not corrected")
     parser.add_argument("--quiet", action="store_true", help="Reduce output")
+    parser.add_argument("--ports", type=str, help="Comma-separated serial ports to provision in parallel (overrides MESHTASTIC_PORT)")
 
     args = parser.parse_args()
 
@@ -175,49 +346,23 @@ def main():
         print("[ERROR] --set-channel requires --name and --psk")
         sys.exit(2)
 
-    # Open serial interface (env MESHTASTIC_PORT recommended to avoid TCP fallback)
-    iface = get_radio_interface()
-    try:
-        node = _api_get_node(iface)
-        if not node:
-            print("[ERROR] Serial interface did not initialize (no localNode). Set MESHTASTIC_PORT to your /dev/tty.* path.")
+    # Dedupe (order kept) so two workers never open the same device
+    ports = list(dict.fromkeys(p.strip() for p in (args.ports or "").split(",") if p.strip()))
+    if len(ports) > 1:
+        # Serial I/O is blocking, so one thread per radio overlaps the open/read/write latency
+        with ThreadPoolExecutor(max_workers=min(len(ports), 8)) as ex:
+            results = list(ex.map(lambda p: provision_one(p, args, set_url), ports))
+        for p, rc in zip(ports, results):
+            log(f"{p}: {'ok' if rc == 0 else 'FAILED'}", level="INFO" if rc == 0 else "ERROR")
+        failed = [p for p, rc in zip(ports, results) if rc != 0]
+        if failed:
+            print(f"[ERROR] Provisioning failed on: {', '.join(failed)}")
             sys.exit(2)
+        return
 
-        changed_any = False
-
-        # URL
-        if args.apply_url:
-            did = _ensure_url(node, set_url, dry_run=args.dry_run)
-            log(("Would apply URL" if args.dry_run else "Applied URL") if did else "URL already matches", quiet=args.quiet)
-            changed_any = changed_any or did
-
-        # LoRa
-        if args.enforce_lora:
-            region = args.region or os.getenv("MESHTASTIC_LORA_REGION")
-            preset = args.preset or os.getenv("MESHTASTIC_LORA_MODEM_PRESET")
-            did = _ensure_lora(node, region, preset, dry_run=args.dry_run)
-            if region or preset:
-                log(("Would update LoRa" if args.dry_run else "Updated LoRa") if did else "LoRa already matches", quiet=args.quiet)
-            else:
-                log("No region/preset provided; skipping LoRa changes", level="WARN", quiet=args.quiet)
-            changed_any = changed_any or did
-
-        # Channel
-        if args.set_channel:
-            did = _ensure_channel(node, index=args.index, name=args.name, psk=args.psk, dry_run=args.dry_run)
-            log(("Would update channel" if args.dry_run else "Updated channel") if did else "Channel already matches", quiet=args.quiet)
-            changed_any = changed_any or did
-
-        if args.dry_run:
-            log("Dry-run complete.", quiet=args.quiet)
-        else:
-            log("Provisioning complete." if changed_any else "No changes were necessary.", quiet=args.quiet)
-
-    finally:
-        try:
-            iface.close()
-        except Exception:
-            pass
+    rc = provision_one(ports[0] if ports else None, args, set_url)
+    if rc != 0:
+        sys.exit(rc)
 
 if __name__ == "__main__":
     main()
@@ -1,7 +1,8 @@
 from dotenv import load_dotenv; load_dotenv()
 import os
 import glob
-import time
+import inspect
+import threading
 from typing import Optional
 # Use the correct Meshtastic interface classes for each transport
 from meshtastic.serial_interface import SerialInterface
@@ -42,38 +43,65 @@ def _api_set_url(node, url: str) -> bool:
         pass
     return False
 
-def apply_url_config(url: str):
+def apply_url_config(url: str, iface=None) -> bool:
     """Apply a Complete URL via Meshtastic API (no CLI).
     If the device already matches this URL (includeAll=True), skip re-applying to avoid unnecessary reboots.
+    Uses `iface` when given (left open); otherwise opens and closes a temporary interface.
+    Returns True if a new URL was written.
     """
     tmp_iface = None
     try:
-        tmp_iface = get_radio_interface()
-        node = _api_get_node(tmp_iface)
+        if iface is None:
+            tmp_iface = iface = get_radio_interface()
+        node = _api_get_node(iface)
         if not node:
-            return
+            return False
         try:
             current = node.getURL(includeAll=True)
         except Exception:
             current = None
         if current and current.strip() == url.strip():
             # Already provisioned with this URL; do nothing
-            return
-        _api_set_url(node, url)
+            return False
+        return _api_set_url(node, url)
     finally:
-        try:    
+        try:
             if tmp_iface is not None and hasattr(tmp_iface, "close"):
                 tmp_iface.close()
         except Exception:
             pass
 
-def _api_find_channel_index_by_name(node, name: str, max_channels: int = 8) -> Optional[int]:
-    """Scan channel indices via API and return the index whose name matches."""
+def _channel_name_psk(ch) -> tuple:
+    # Protobuf fields may differ across versions; try common names
+    s = getattr(ch, "settings", ch)
+    name = getattr(s, "name", "") or getattr(ch, "name", "")
+    psk = getattr(s, "psk", "") or getattr(ch, "psk", "")
+    return name, psk
+
+def _api_channels_snapshot(node, max_channels: int = 8) -> dict:
+    """Return {index: (name, psk)} for the node's channels in one pass over node.channels.
+    Falls back to per-index lookups on builds without a populated .channels list.
+    """
+    snap = {}
+    chans = getattr(node, "channels", None)
+    if chans:
+        for i, ch in enumerate(chans):
+            if ch:
+                snap[getattr(ch, "index", i)] = _channel_name_psk(ch)
+        return snap
     for i in range(max_channels):
         ch = _api_get_channel(node, i)
-        if not ch:
-            continue
-        ch_name = getattr(getattr(ch, "settings", ch), "name", "") or getattr(ch, "name", "")
+        if ch:
+            snap[i] = _channel_name_psk(ch)
+    return snap
+
+def _api_find_channel_index_by_name(node, name: str, max_channels: int = 8, snapshot: Optional[dict] = None) -> Optional[int]:
+    """Return the index of the channel whose name matches, from one channel snapshot.
+    Pass `snapshot` (from _api_channels_snapshot) to reuse channels already read.
+    """
+    if snapshot is None:
+        snapshot = _api_channels_snapshot(node, max_channels)
+    for i, (ch_name, _psk) in snapshot.items():
         if ch_name == name:
             return i
     return None
@@ -163,9 +191,9 @@ def _resolve_serial_devpath(env_path: Optional[str] = None) -> Optional[str]:
             return candidates[0]
     return None
 
-def get_radio_interface():
-    """Create a Meshtastic SerialInterface using an env devPath if valid, else auto-resolve, else library auto-detect."""
-    devpath = os.getenv("MESHTASTIC_PORT")
+def get_radio_interface(port: Optional[str] = None):
+    """Create a Meshtastic SerialInterface using `port` (or env devPath) if valid, else auto-resolve, else library auto-detect."""
+    devpath = port or os.getenv("MESHTASTIC_PORT")
     resolved = _resolve_serial_devpath(devpath)
     if resolved:
         if devpath and devpath != resolved:
@@ -176,39 +204,56 @@ def get_radio_interface():
     print("[INFO] No explicit serial device found; attempting library auto-detect (may try TCP on failure)...")
     return SerialInterface()
 
+def _accepts_packet_and_interface(fn) -> bool:
+    """True if pypubsub can call `fn(packet=..., interface=...)` as-is."""
+    try:
+        params = inspect.signature(fn).parameters.values()
+    except (TypeError, ValueError):
+        return False
+    names = {p.name for p in params if p.kind in (p.POSITIONAL_OR_KEYWORD, p.KEYWORD_ONLY)}
+    has_var_kw = any(p.kind is p.VAR_KEYWORD for p in params)
+    return "packet" in names and ("interface" in names or has_var_kw)
+
 class RadioInterface:
     @staticmethod
-    def read_channel_config(index=DEFAULT_CHANNEL_INDEX):
-        """Read channel config via Meshtastic API (preferred), fallback to CLI parse."""
-        # API path
+    def read_channel_config(index=DEFAULT_CHANNEL_INDEX, iface=None):
+        """Read channel config via Meshtastic API.
+        Uses `iface` when given (left open); otherwise opens and closes a temporary interface.
+        """
+        tmp = None
         try:
-            tmp = get_radio_interface()
-            node = _api_get_node(tmp)
+            if iface is None:
+                tmp = iface = get_radio_interface()
+            node = _api_get_node(iface)
             if node:
                 ch = _api_get_channel(node, index)
                 if ch:
-                    # Protobuf fields may differ across versions; try common names
-                    name = getattr(getattr(ch, "settings", ch), "name", "") or getattr(ch, "name", "")
-                    psk = getattr(getattr(ch, "settings", ch), "psk", "") or getattr(ch, "psk", "")
-                    tmp.close()
+                    name, psk = _channel_name_psk(ch)
                     return {"name": name, "psk": psk}
-            tmp.close()
         except Exception:
             pass
+        finally:
+            if tmp is not None:
+                try:
+                    tmp.close()
+                except Exception:
+                    pass
         return None
 
     @staticmethod
-    def write_channel_config(name, psk, index=DEFAULT_CHANNEL_INDEX, ble=None, host=None, port=None):
-        """Prefer Meshtastic API to update/create channel; fallback to CLI behavior."""
-        # API path
+    def write_channel_config(name, psk, index=DEFAULT_CHANNEL_INDEX, ble=None, host=None, port=None, iface=None):
+        """Update/create a channel via Meshtastic API.
+        Uses `iface` when given (left open); otherwise opens and closes a temporary interface.
+        """
+        tmp = None
         try:
-            tmp = get_radio_interface()
-            node = _api_get_node(tmp)
+            if iface is None:
+                tmp = iface = get_radio_interface()
+            node = _api_get_node(iface)
             if node:
                 # If primary, update in place only
                 if index == 0:
                     _api_set_channel(node, index, name=name, psk=psk)
-                    tmp.close()
                     return
                 # If channel exists, update; if not, add then set PSK without index
                 ch = _api_get_channel(node, index)
@@ -226,16 +271,21 @@ class RadioInterface:
                     # If addChannel unavailable, attempt setChannel to a higher free index anyway
                     if not added:
                         _api_set_channel(node, index, name=name, psk=psk)
-                tmp.close()
-                return
-            tmp.close()
         except Exception:
             pass
+        finally:
+            if tmp is not None:
+                try:
+                    tmp.close()
+                except Exception:
+                    pass
 
     def __init__(self):
         self.iface = get_radio_interface()
         self._subscribed = False
         self.default_channel_index = DEFAULT_CHANNEL_INDEX
+        # Set by close(); run_forever blocks on it instead of polling
+        self._stop = threading.Event()
 
     def send(self, message: str, channel_index: int = None):
         """Send a message to the specified Meshtastic channel."""
@@ -243,62 +293,74 @@ class RadioInterface:
         self.iface.sendText(message, channelIndex=idx)
 
     def on_receive(self, callback):
-        """Register a callback to handle incoming messages (both iface and pubsub)."""
+        """Register `callback(packet, interface=None)` for incoming messages.
+        Such callbacks are subscribed to meshtastic.receive directly, with no wrapper frame
+        per packet; packet-only `callback(packet)` callbacks are adapted once here.
+        Subscribe errors propagate instead of leaving the caller silently deaf.
+        """
         if not self._subscribed:
-            # Direct interface callback (works across versions)
-            try:
-                def _iface_on_receive(packet, interface):
+            listener = callback
+            if not _accepts_packet_and_interface(callback):
+                def listener(packet=None, interface=None):
                     callback(packet)
-                self.iface.onReceive = _iface_on_receive
-            except Exception:
-                pass
-            # PubSub as a secondary path
-            try:
-                pub.subscribe(lambda packet=None, interface=None, **kw: callback(packet), "meshtastic.receive")
-            except Exception:
-                pass
+            pub.subscribe(listener, "meshtastic.receive")
+            # pypubsub only holds weak references, so keep the listener on self
+            # or it is collected right away.
+            self._pub_listener = listener
             self._subscribed = True
 
     def run_forever(self):
-        """Keep the radio interface alive to receive messages."""
+        """Keep the radio interface alive to receive messages until close() or Ctrl+C."""
         try:
-            while True:
-                time.sleep(1)
+            self._stop.wait()
         except KeyboardInterrupt:
             self.close()
 
     def close(self):
-        """Clean up the serial connection."""
+        """Clean up the serial connection and release run_forever."""
+        self._stop.set()
         self.iface.close()
 
 def configure_channel(index=DEFAULT_CHANNEL_INDEX):
     """Set up a Meshtastic channel using environment variables and connection type.
-    Uses the Meshtastic CLI to read/write channel config before opening a Python interface
-    to avoid serial-port lock conflicts.
+    URL and channel read/compare/write all go through the one interface that is returned,
+    so the serial port is opened once unless a new URL had to be applied.
     """
     name = os.getenv("MINIHTTP_CHANNEL_NAME", "webtastic")
     psk = os.getenv("MINIHTTP_CHANNEL_PSK", "0x8e2a4b7c5d1e3f6a9b0c2d4e6f8a1b3c5d7e9f0a2b4c6d8e0f1a3b5c7d9e1f2a")
 
-    # If a Complete URL is provided, apply it deterministically before opening the interface
+    # If a Complete URL is provided, apply it deterministically
     seturl = os.getenv("MESHTASTIC_SETURL") or os.getenv("MESHTASTIC_CONFIG_URL")
+
+    # Open the interface we return once and reuse it for URL/channel check and write
+    radio = RadioInterface()
     if seturl:
-        apply_url_config(seturl)
-    else:
-        # Read current config BEFORE opening any interface (prevents port busy issues)
-        current = RadioInterface.read_channel_config(index=index)
+        if apply_url_config(seturl, iface=radio.iface):
+            # A new URL can carry LoRa changes that reboot the node; start from a fresh link
+            radio.close()
+            radio = RadioInterface()
+
+    # One channel snapshot serves both the compare and the index lookup below;
+    # it is only re-read if we actually wrote a channel
+    snapshot = None
+    if not seturl:
+        try:
+            node = _api_get_node(radio.iface)
+            snapshot = _api_channels_snapshot(node) if node else {}
+        except Exception:
+            snapshot = {}
         # Only write if needed
-        if (not current) or (current.get("name") != name) or (current.get("psk") != psk):
-            RadioInterface.write_channel_config(name, psk, index=index)
+        if snapshot.get(index) != (name, psk):
+            RadioInterface.write_channel_config(name, psk, index=index, iface=radio.iface)
+            snapshot = None
 
-    # Optionally return an open interface for immediate use
-    radio = RadioInterface()
     # Try to discover the desired channel index by name; fall back to provided index
     try:
         node = _api_get_node(radio.iface)
         if node:
             # Optionally enforce region/preset from env so it doesn’t drift
             ensure_lora_settings(node)
-            resolved = _api_find_channel_index_by_name(node, name)
+            resolved = _api_find_channel_index_by_name(node, name, snapshot=snapshot)
             radio.default_channel_index = resolved if resolved is not None else index
         else:
             radio.default_channel_index = index
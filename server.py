@@ -4,7 +4,7 @@ read_messages.py — Minimal, single-open Meshtastic reader (API-only, serial-on
 
 Key improvements vs the GitHub snippet you found:
   * Opens the serial interface ONCE (avoids port lock errors)
-  * Subscribes to meshtastic.receive and also hooks iface.onReceive
+  * Subscribes to meshtastic.receive (single RX path, no duplicate handling)
   * Works with env-based port selection (supports wildcards)
   * Robust TEXT_MESSAGE_APP parsing (decoded.text or payload bytes)
   * Optionally prints a compact node list for name lookup
@@ -13,30 +13,60 @@ Usage:
   MESHTASTIC_PORT=/dev/ttyACM0 python read_messages.py
   # or
   MESHTASTIC_PORT="/dev/ttyACM*" python read_messages.py
+
+Env flags
+  DEBUG_VERBOSE=1           # print full packet dicts / parsed JSON per RX and full TX payloads
+  SNIFF_HEARTBEAT=1         # send a JSON heartbeat every 5 s
 """
+import collections
 import json
 import os
+import queue
 import sys
 import time
 import threading
 import traceback
 
+from functools import lru_cache, partial
 from pathlib import Path
 from urllib.parse import unquote
 
 VERBOSE = True  # set False to quiet non-JSON traffic
 
-TRUTHY = {"1", "true", "yes", "on", "y"}
+TRUTHY = frozenset({"1", "true", "yes", "on", "y"})
 
+@lru_cache(maxsize=32)
 def _is_on(name: str) -> bool:
+    """Truthy env flag; cached since flags do not change at runtime."""
     return (os.getenv(name) or "").strip().lower() in TRUTHY
 
+
+# Debug flags are read once at import; hot paths test a plain constant
+_DEBUG_VERBOSE = _is_on('DEBUG_VERBOSE')
+_SNIFF_HEARTBEAT = _is_on('SNIFF_HEARTBEAT')
+
 from pubsub import pub
 
 from radio import RadioInterface  # uses our resilient port resolution & wiring helpers
 
 from fragment import fragment_html_file
 
+try:
+    import orjson  # optional: much faster JSON on Pi-class hosts
+except Exception:
+    orjson = None
+
+
+def _dumps(obj) -> str:
+    """Compact JSON text for the wire (orjson when available)."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, separators=(",", ":"))
+
+
+def _loads(txt):
+    return orjson.loads(txt) if orjson is not None else json.loads(txt)
+
 
 def _payload_text(decoded: dict) -> str | None:
     """Extract UTF-8 text from a decoded dict that may have 'text' or byte 'payload'."""
@@ -56,28 +86,61 @@ def _payload_text(decoded: dict) -> str | None:
     return None
 
 
+@lru_cache(maxsize=64)
+def _envelopes_cached(path: str, fs_path: str, mtime_ns: int) -> tuple:
+    """Wire-ready RESP envelopes for one file, built once per (request path, file, mtime).
+    An edited file gets a new key, so stale fragments are never served.
+    """
+    frags = fragment_html_file(fs_path)
+    total = len(frags)
+    # Constant envelope parts are serialized once; per fragment only frag/data are spliced in
+    head = '{"type":"RESP","path":' + _dumps(path) + ',"frag":'
+    mid = f',"of_frag":{total},"data":'
+    return tuple(f"{head}{i}{mid}{_dumps(chunk)}}}" for i, chunk in enumerate(frags, start=1))
+
+
+def _envelopes(path: str, fs_path: str) -> tuple:
+    # os.stat raises FileNotFoundError for a missing file, same as opening it would
+    return _envelopes_cached(path, fs_path, os.stat(fs_path).st_mtime_ns)
+
+
+def _default_channel_index() -> int:
+    ch_env = (os.getenv('DEFAULT_CHANNEL_INDEX') or '1').strip()
+    return int(ch_env) if ch_env.isdigit() else 1
+
+
+# Resolved once at import instead of on every send
+_DEFAULT_CHANNEL_INDEX = _default_channel_index()
+
+
+def _bind_sender(radio, iface):
+    """Resolve the send callable once; prefer the RadioInterface wrapper if it has .send."""
+    if hasattr(radio, 'send'):
+        return radio.send
+    return partial(iface.sendText, channelIndex=_DEFAULT_CHANNEL_INDEX)
+
+
 # Helper to send a text payload (for heartbeat etc)
-def _send_text(radio, iface, payload: str):
+def _send_text(send, payload: str):
     try:
-        ch_env = os.getenv('DEFAULT_CHANNEL_INDEX', '1')
-        ch = int(ch_env) if ch_env.isdigit() else 1
-    except Exception:
-        ch = 1
-    try:
-        # Prefer RadioInterface wrapper if it has .send
-        if hasattr(radio, 'send'):
-            print(f"[TX  ] channel={ch} payload={payload}")
-            radio.send(payload)
-        else:
-            print(f"[TX  ] channel={ch} payload={payload}")
-            iface.sendText(payload, channelIndex=ch)
+        # Callers log a one-line summary; the full payload is only formatted when verbose
+        if _DEBUG_VERBOSE:
+            print(f"[TX  ] channel={_DEFAULT_CHANNEL_INDEX} payload={payload}")
+        send(payload)
     except Exception as e:
-        print(f"[WARN] Heartbeat send error: {e}")
+        print(f"[WARN] Send error: {e}")
 
 
 def main():
+    # Callbacks print from meshtastic's threads; keep output flowing when piped
+    try:
+        sys.stdout.reconfigure(line_buffering=True)
+    except Exception:
+        pass
+
     radio = RadioInterface()
     iface = getattr(radio, "iface", radio)
+    send = _bind_sender(radio, iface)
 
     # Diagnostics
     dev = getattr(iface, 'devPath', None) or getattr(iface, 'port', None)
@@ -85,6 +148,8 @@ def main():
 
     base_dir = Path(__file__).resolve().parent
     html_dir = base_dir / 'html'
+    # Resolved once; every GET is checked against it
+    html_root = html_dir.resolve()
     print(f"[INFO] Base dir: {base_dir}")
     print(f"[INFO] HTML dir: {html_dir} exists={html_dir.exists()}")
 
@@ -114,9 +179,37 @@ def main():
     except Exception:
         print("[WARN] Could not determine local node id")
 
+    # Outgoing payloads go through one TX thread: a multi-fragment reply can take
+    # seconds of airtime and must not block meshtastic's receive callback
+    tx_q = queue.Queue()
+
+    def _tx_loop():
+        while True:
+            payload = tx_q.get()
+            if payload is None:
+                return
+            _send_text(send, payload)
+
+    # Daemon so a send wedged in the radio cannot keep the process alive at exit
+    tx_thread = threading.Thread(target=_tx_loop, name="tx", daemon=True)
+    tx_thread.start()
+
+    # Recently handled packet ids; a repeat delivery must not trigger a second reply
+    seen_ids = collections.OrderedDict()
+
     def handle_packet(packet):
-        # Always show the raw dict
-        print(f"[RAW ] {packet}")
+        # meshtastic publishes plain dicts; anything else is nothing we can answer
+        if type(packet) is not dict:
+            return
+        pid = packet.get('id')
+        if pid is not None:
+            if pid in seen_ids:
+                return
+            seen_ids[pid] = None
+            if len(seen_ids) > 256:
+                seen_ids.popitem(last=False)
+        if _DEBUG_VERBOSE:
+            print(f"[RAW ] {packet}")
         try:
             # Basic fields
             from_id = packet.get('fromId') or packet.get('from')
@@ -125,23 +218,37 @@ def main():
                 print("[INFO] Skipping self-originated packet")
                 return
 
-            dec = packet.get('decoded') if isinstance(packet, dict) else None
-            portnum = dec.get('portnum') if isinstance(dec, dict) else None
-            txt = dec.get('text') if isinstance(dec, dict) else None
+            dec = packet.get('decoded')
+            if type(dec) is dict:
+                portnum = dec.get('portnum')
+                txt = dec.get('text')
+            else:
+                dec = portnum = txt = None
+            # Compact one-line summary; the full dict is only formatted when verbose
+            print(f"[RX  ] portnum={portnum} from={from_id}")
 
             # Try to parse JSON if present
             req = None
-            if isinstance(txt, str):
-                try:
-                    req = json.loads(txt)
-                    print(f"[JSON] {req}")
-                except Exception:
+            if type(txt) is str:
+                # Only a JSON object can be a MiniHTTP request; plain chat skips the parse
+                if txt.lstrip()[:1] == '{':
+                    try:
+                        req = _loads(txt)
+                        if _DEBUG_VERBOSE:
+                            print(f"[JSON] {req}")
+                    except Exception:
+                        pass
+                    # Objects without a "type" (other tools' JSON) are treated as text
+                    if type(req) is not dict or 'type' not in req:
+                        req = None
+                if req is None:
                     # Not JSON → fall through to echo below
                     print(f"[TEXT] {txt}")
 
             # If it's a proper MiniHTTP GET, serve fragments
-            is_get = isinstance(req, dict) and str(req.get('type', '')).upper() == 'GET'
-            print(f"[DEBUG] is_get={is_get} portnum={portnum}")
+            is_get = req is not None and str(req['type']).upper() == 'GET'
+            if _DEBUG_VERBOSE:
+                print(f"[DEBUG] is_get={is_get} portnum={portnum}")
             if is_get:
                 try:
                     path = req.get('path') or '/'
@@ -153,10 +260,11 @@ def main():
                         rel_path = raw_path[len('/html/'):]
                     else:
                         rel_path = raw_path.lstrip('/')
-                    # Prevent path traversal
-                    candidate = (html_dir / rel_path).resolve()
-                    if not str(candidate).startswith(str(html_dir.resolve())):
-                        err = json.dumps({
+                    # Prevent path traversal: the resolved target must live under html/
+                    # (a string prefix test would also accept siblings like html_old/)
+                    candidate = (html_root / rel_path).resolve()
+                    if candidate != html_root and html_root not in candidate.parents:
+                        err = _dumps({
                             "type": "RESP",
                             "path": path,
                             "frag": 1,
@@ -164,21 +272,25 @@ def main():
                             "data": "400: invalid path"
                         })
                         print(f"[WARN] Rejected path traversal: {candidate}")
-                        _send_text(radio, iface, err)
+                        tx_q.put(err)
                         return
 
                     print(f"[INFO] FS lookup: req='{path}' → abs='{candidate}'")
 
-                    # Try reading and fragmenting
-                    try:
-                        frags = fragment_html_file(str(candidate))
-                    except FileNotFoundError:
+                    # Try reading and fragmenting; a miss is a stat, not an exception
+                    envs = None
+                    if candidate.is_file():
+                        try:
+                            envs = _envelopes(path, str(candidate))
+                        except FileNotFoundError:
+                            pass  # removed between the check and the read
+                    if envs is None:
                         # Extra debug to show what actually exists
                         try:
                             listing = ', '.join(sorted(p.name for p in html_dir.iterdir()))
                         except Exception:
                             listing = '(unavailable)'
-                        err = json.dumps({
+                        err = _dumps({
                             "type": "RESP",
                             "path": path,
                             "frag": 1,
@@ -187,10 +299,28 @@ def main():
                         })
                         print(f"[WARN] File not found: {candidate}")
                         print(f"[WARN] HTML dir exists={html_dir.exists()} contents=[{listing}]")
-                        _send_text(radio, iface, err)
+                        tx_q.put(err)
                         return
 
-                    total = len(frags)
+                    # Cached, pre-serialized envelopes: serving a fragment is an index
+                    total = len(envs)
+
+                    # Batched re-request: {"missing": [3, 7, 9]} → just those fragments
+                    missing = req.get('missing')
+                    if isinstance(missing, list):
+                        wanted = []
+                        for m in missing:
+                            try:
+                                i = int(m)
+                            except Exception:
+                                continue
+                            if 1 <= i <= total and i not in wanted:
+                                wanted.append(i)
+                        for i in wanted:
+                            payload = envs[i - 1]
+                            print(f"[TX  ] {path} frag {i}/{total} (missing)")
+                            tx_q.put(payload)
+                        return
 
                     # If a single fragment is requested
                     if frag is not None:
@@ -199,40 +329,25 @@ def main():
                         except Exception:
                             i = -1
                         if 1 <= i <= total:
-                            env = {
-                                "type": "RESP",
-                                "path": path,
-                                "frag": i,
-                                "of_frag": total,
-                                "data": frags[i - 1],
-                            }
-                            payload = json.dumps(env)
+                            payload = envs[i - 1]
                             print(f"[TX  ] {path} frag {i}/{total}")
-                            _send_text(radio, iface, payload)
+                            tx_q.put(payload)
                             return
                         else:
                             print(f"[WARN] Requested out-of-range frag {frag} for {path}")
                             return
 
                     # Otherwise send all fragments in order
-                    for idx, chunk in enumerate(frags, start=1):
-                        env = {
-                            "type": "RESP",
-                            "path": path,
-                            "frag": idx,
-                            "of_frag": total,
-                            "data": chunk,
-                        }
-                        payload = json.dumps(env)
+                    for idx, payload in enumerate(envs, start=1):
                         print(f"[TX  ] {path} {idx}/{total}")
-                        _send_text(radio, iface, payload)
+                        tx_q.put(payload)
                     return
                 except Exception:
                     print("[ERROR] GET handling failed:\n" + traceback.format_exc())
                     # fall through to default echo
 
             # Default behavior: echo what we got (like the reader)
-            if isinstance(txt, str):
+            if type(txt) is str:
                 data_preview = (txt[:200] + '…') if len(txt) > 200 else txt
             else:
                 data_preview = f"port={portnum} id={packet.get('id')}"
@@ -243,11 +358,11 @@ def main():
                 "of_frag": 1,
                 "data": f"echo: {data_preview}"
             }
-            payload = json.dumps(resp)
+            payload = _dumps(resp)
             print(f"[ECHO] {payload}")
-            _send_text(radio, iface, payload)
+            tx_q.put(payload)
 
-            if VERBOSE and isinstance(dec, dict) and not isinstance(txt, str):
+            if VERBOSE and dec is not None and type(txt) is not str:
                 # Show non-text payloads briefly
                 payload_raw = dec.get('payload')
                 bf = dec.get('bitfield')
@@ -255,21 +370,36 @@ def main():
         except Exception as e:
             print(f"[WARN] Parse error: {e} | packet={packet}")
 
-    # Attach direct interface callback
-    try:
-        def _iface_on_receive(packet, interface):
-            print("[IFACE]")
+    # Set on Ctrl+C; the heartbeat, the RX worker and the main wait all watch it
+    stop = threading.Event()
+
+    # Packets are handled on one RX worker so meshtastic's receive thread only
+    # enqueues; bounded so a burst cannot grow memory without limit
+    rx_q = queue.Queue(maxsize=64)
+
+    def _rx_loop():
+        # Blocks with no idle wakeups; shutdown enqueues a None sentinel
+        while True:
+            packet = rx_q.get()
+            if packet is None:
+                return
             handle_packet(packet)
-        iface.onReceive = _iface_on_receive
-        print("[INFO] Attached iface.onReceive callback")
-    except Exception as e:
-        print(f"[WARN] Could not attach iface.onReceive: {e}")
 
-    # Subscribe to pubsub as well
+    rx_thread = threading.Thread(target=_rx_loop, name="rx", daemon=True)
+    rx_thread.start()
+
+    # Single RX path: meshtastic publishes every packet to meshtastic.receive;
+    # also hooking iface.onReceive made each GET get answered twice.
     try:
         def _on_pub(packet=None, interface=None, **kw):
-            print("[PUBSB]")
-            handle_packet(packet)
+            if _DEBUG_VERBOSE:
+                print("[PUBSB]")
+            if packet is None or stop.is_set():
+                return
+            try:
+                rx_q.put_nowait(packet)
+            except queue.Full:
+                print(f"[WARN] RX queue full; dropping packet id={packet.get('id') if type(packet) is dict else None}")
         pub.subscribe(_on_pub, "meshtastic.receive")
         print("[INFO] Subscribed to meshtastic.receive")
     except Exception as e:
@@ -277,33 +407,63 @@ def main():
 
     print("[INFO] Listening… Ctrl+C to stop")
     print(f"[INFO] MESHTASTIC_PORT={os.getenv('MESHTASTIC_PORT')} | DEFAULT_CHANNEL_INDEX={os.getenv('DEFAULT_CHANNEL_INDEX','1')} | SNIFF_HEARTBEAT={os.getenv('SNIFF_HEARTBEAT','0')}")
+    hb_thread = None
     # Optional heartbeat beacon: set SNIFF_HEARTBEAT=1 to enable
-    if _is_on('SNIFF_HEARTBEAT'):
+    if _SNIFF_HEARTBEAT:
+        # Resolve our shortname once; only seq/ts change per beat
+        local_sn = shortnames.get(str(getattr(getattr(iface, 'localNode', None), 'myInfo', None))) or None
+        hb_tmpl = {"type": "HB", "node": local_sn}
+
         def _hb_loop():
             n = 0
+            # Fixed monotonic schedule: send time does not accumulate as drift,
+            # and wall-clock jumps do not shorten or stretch the interval
+            next_at = time.monotonic()
             while True:
                 try:
                     # JSON heartbeat so other tools can parse
-                    hb = json.dumps({"type": "HB", "node": shortnames.get(str(getattr(getattr(iface, 'localNode', None), 'myInfo', None)), None), "seq": n, "ts": int(time.time())})
-                    _send_text(radio, iface, hb)
+                    hb_tmpl["seq"] = n
+                    hb_tmpl["ts"] = int(time.time())
+                    hb = _dumps(hb_tmpl)
+                    print(f"[HB  ] seq={n}")
+                    tx_q.put(hb)
                     n += 1
                 except Exception as e:
                     print(f"[WARN] Heartbeat loop error: {e}")
-                time.sleep(5)
-        threading.Thread(target=_hb_loop, daemon=True).start()
+                next_at += 5.0
+                if stop.wait(max(0.0, next_at - time.monotonic())):
+                    return
+        hb_thread = threading.Thread(target=_hb_loop)
+        hb_thread.start()
         print("[INFO] Heartbeat enabled (SNIFF_HEARTBEAT=1)")
 
     try:
-        while True:
-            sys.stdout.flush()
-            time.sleep(1)
+        stop.wait()
     except KeyboardInterrupt:
         print("[INFO] Exiting…")
+    finally:
+        stop.set()
+        # Stop intake first so the RX queue can only shrink from here
+        try:
+            pub.unsubscribe(_on_pub, "meshtastic.receive")
+        except Exception:
+            pass
+        if hb_thread is not None:
+            hb_thread.join(timeout=2.0)
+        # Intake is closed, so the queue only drains and the sentinel gets in once
+        # the worker catches up; the worker is a daemon if a handler is wedged
+        try:
+            rx_q.put(None, timeout=5.0)
+        except queue.Full:
+            print("[WARN] RX worker did not drain; exiting without it")
+        # Finish packets already received, then let their replies go out
+        rx_thread.join(timeout=5.0)
+        tx_q.put(None)
+        tx_thread.join(timeout=5.0)
         try:
             iface.close()
         except Exception:
             pass
 
-
 if __name__ == "__main__":
     main()